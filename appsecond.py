@@ -1,11 +1,58 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
-import pandas as pd
-import requests
+import polars as pl
+import orjson
+import httpx
+import asyncio
+import hashlib
 from io import BytesIO
 
+from validation_engine import (
+    ISSUE_COLS, RECEIVED_COLS, cache_excel, cached_excel, read_excel, reconcile
+)
+
 app = FastAPI(title="Subcontract Reconciliation API")
 
+# Seconds allowed for each connect/read/write step of a blob download
+DOWNLOAD_TIMEOUT = 30
+
+
+# -----------------------------
+# Blob Download
+# -----------------------------
+async def fetch_excel(client: httpx.AsyncClient, url: str, name: str, columns: tuple) -> pl.DataFrame:
+    # A HEAD is enough to reuse a blob that has not changed since the last call
+    head = await client.head(url)
+    version = head.headers.get("etag") or head.headers.get("last-modified")
+    blob_key = (url, version, columns) if head.status_code == 200 and version else None
+
+    if blob_key is not None:
+        df = cached_excel(blob_key)
+        if df is not None:
+            return df
+
+    # Stream the body straight into one buffer, hashing it on the way in
+    buffer = BytesIO()
+    hasher = hashlib.blake2b(digest_size=16)
+
+    async with client.stream("GET", url) as response:
+        if response.status_code != 200:
+            raise HTTPException(status_code=400, detail=f"Failed to download {name} file")
+
+        async for chunk in response.aiter_bytes():
+            buffer.write(chunk)
+            hasher.update(chunk)
+
+    # getvalue() hands over the buffer's bytes without copying, so the blob is
+    # held once while it parses. Same content under a different URL still
+    # skips the Excel decode.
+    df = await asyncio.to_thread(read_excel, buffer.getvalue(), columns, hasher.digest())
+
+    if blob_key is not None:
+        cache_excel(blob_key, df)
+
+    return df
+
 
 # -----------------------------
 # Request Model (Azure Agent Compatible)
@@ -26,136 +73,40 @@ async def validate(request: ValidationRequest):
     # -----------------------------
     # STEP 1: Download Excel Files
     # -----------------------------
+    # Both files download concurrently, so one parses while the other is still streaming
     try:
-        issue_response = requests.get(request.issue_blob_url)
-        received_response = requests.get(request.received_blob_url)
-
-        if issue_response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to download issue file")
-
-        if received_response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to download received file")
-
-        issue_df = pd.read_excel(BytesIO(issue_response.content))
-        received_df = pd.read_excel(BytesIO(received_response.content))
+        async with httpx.AsyncClient(follow_redirects=True, timeout=DOWNLOAD_TIMEOUT) as client:
+            issue_df, received_df = await asyncio.gather(
+                fetch_excel(client, request.issue_blob_url, "issue", ISSUE_COLS),
+                fetch_excel(client, request.received_blob_url, "received", RECEIVED_COLS)
+            )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File processing error: {str(e)}")
 
-    route_card = request.route_card
-    supplier = request.supplier
-
     # -----------------------------
-    # STEP 2: Clean Column Names
+    # STEP 2: Reconcile Issue vs Received
     # -----------------------------
-    issue_df.columns = issue_df.columns.str.strip()
-    received_df.columns = received_df.columns.str.strip()
+    mismatch_df = reconcile(issue_df, received_df, request.route_card, request.supplier)
 
     # -----------------------------
-    # STEP 3: Normalize Key Columns (CRITICAL)
+    # STEP 3: Prepare Clean Output
     # -----------------------------
-    issue_df["RouteCard No"] = issue_df["RouteCard No"].astype(str).str.strip()
-    received_df["RouteCard No"] = received_df["RouteCard No"].astype(str).str.strip()
+    summary = mismatch_df.select(
+        pl.col("RouteCard No").alias("route_card"),
+        pl.col("DC No").alias("dc_no"),
+        pl.col("FG Item Code").alias("fg_item_code"),
+        pl.col("Supplier Name").alias("supplier"),
+        pl.col("Issue_Qty").alias("issue_qty"),
+        pl.col("Received_Qty").alias("received_qty"),
+        pl.col("Difference").alias("difference")
+    ).to_dicts()
 
-    issue_df["GK DC No"] = issue_df["GK DC No"].astype(str).str.strip()
-    received_df["Subcon DC No"] = received_df["Subcon DC No"].astype(str).str.strip()
-
-    issue_df["FG Item Code"] = issue_df["FG Item Code"].astype(str).str.strip()
-    received_df["FG Item Code"] = received_df["FG Item Code"].astype(str).str.strip()
-
-    issue_df["Supplier Name"] = issue_df["Supplier Name"].astype(str).str.strip()
-    received_df["Supplier Name"] = received_df["Supplier Name"].astype(str).str.strip()
-
-    # Ensure numeric quantity columns
-    issue_df["Transfer Qty"] = pd.to_numeric(issue_df["Transfer Qty"], errors="coerce").fillna(0)
-    received_df["Rcvd. Qty"] = pd.to_numeric(received_df["Rcvd. Qty"], errors="coerce").fillna(0)
-
-    # -----------------------------
-    # STEP 4: Aggregate ISSUE
-    # -----------------------------
-    issue_grouped = (
-        issue_df
-        .groupby(
-            ["RouteCard No", "GK DC No", "FG Item Code", "Supplier Name"],
-            dropna=False
-        )["Transfer Qty"]
-        .sum()
-        .reset_index()
-        .rename(columns={
-            "GK DC No": "DC No",
-            "Transfer Qty": "Issue_Qty"
-        })
-    )
-
-    # -----------------------------
-    # STEP 5: Aggregate RECEIVED
-    # -----------------------------
-    received_grouped = (
-        received_df
-        .groupby(
-            ["RouteCard No", "Subcon DC No", "FG Item Code", "Supplier Name"],
-            dropna=False
-        )["Rcvd. Qty"]
-        .sum()
-        .reset_index()
-        .rename(columns={
-            "Subcon DC No": "DC No",
-            "Rcvd. Qty": "Received_Qty"
-        })
+    # Encode with orjson and return the bytes directly, bypassing jsonable_encoder
+    return Response(
+        orjson.dumps({
+            "mismatch_count": mismatch_df.height,
+            "summary": summary
+        }, option=orjson.OPT_SERIALIZE_NUMPY),
+        media_type="application/json"
     )
-
-    # -----------------------------
-    # STEP 6: Merge
-    # -----------------------------
-    merged = issue_grouped.merge(
-        received_grouped,
-        on=["RouteCard No", "DC No", "FG Item Code", "Supplier Name"],
-        how="outer"
-    )
-
-    merged["Issue_Qty"] = merged["Issue_Qty"].fillna(0)
-    merged["Received_Qty"] = merged["Received_Qty"].fillna(0)
-
-    # -----------------------------
-    # STEP 7: Calculate Difference
-    # -----------------------------
-    merged["Difference"] = merged["Issue_Qty"] - merged["Received_Qty"]
-
-    # Only mismatches
-    mismatch_df = merged[merged["Difference"] != 0]
-
-    # -----------------------------
-    # STEP 8: Optional Filters
-    # -----------------------------
-    if route_card:
-        mismatch_df = mismatch_df[
-            mismatch_df["RouteCard No"] == str(route_card)
-        ]
-
-    if supplier:
-        mismatch_df = mismatch_df[
-            mismatch_df["Supplier Name"] == supplier
-        ]
-
-    # -----------------------------
-    # STEP 9: Prepare Clean Output
-    # -----------------------------
-    mismatch_df = mismatch_df.fillna("")
-
-    summary = []
-
-    for _, row in mismatch_df.iterrows():
-        summary.append({
-            "route_card": row["RouteCard No"],
-            "dc_no": row["DC No"],
-            "fg_item_code": row["FG Item Code"],
-            "supplier": row["Supplier Name"],
-            "issue_qty": row["Issue_Qty"],
-            "received_qty": row["Received_Qty"],
-            "difference": row["Difference"]
-        })
-
-    return {
-        "mismatch_count": len(mismatch_df),
-        "summary": summary
-    }
@@ -0,0 +1,199 @@
+import io
+import math
+
+import pandas as pd
+import polars as pl
+import pytest
+from openpyxl import Workbook
+
+import validation_engine
+from validation_engine import (
+    ISSUE_COLS, KEY_COLS, _pack_keys, _unpack_keys, read_excel, reconcile,
+    validate_store
+)
+
+
+def test_reconcile_treats_non_finite_quantities_as_zero():
+    issue_df = pl.DataFrame({
+        'RouteCard No': ['RC1', 'RC1', 'RC2'],
+        'GK DC No': ['DC1', 'DC1', 'DC2'],
+        'FG Item Code': ['FG1', 'FG1', 'FG2'],
+        'Supplier Name': ['S1', 'S1', 'S2'],
+        'Transfer Qty': ['5', 'nan', 'inf'],
+    })
+    received_df = pl.DataFrame({
+        'RouteCard No': ['RC1', 'RC2'],
+        'Subcon DC No': ['DC1', 'DC2'],
+        'FG Item Code': ['FG1', 'FG2'],
+        'Supplier Name': ['S1', 'S2'],
+        'Rcvd. Qty': ['3', 'NaN'],
+    })
+
+    result = reconcile(issue_df, received_df)
+
+    assert result.to_dicts() == [{
+        'RouteCard No': 'RC1',
+        'DC No': 'DC1',
+        'FG Item Code': 'FG1',
+        'Supplier Name': 'S1',
+        'Issue_Qty': 5.0,
+        'Received_Qty': 3.0,
+        'Difference': 2.0,
+    }]
+
+
+
+def test_reconcile_parses_padded_text_quantities():
+    issue_df = pl.DataFrame({
+        'RouteCard No': ['RC1', 'RC2', 'RC3'],
+        'GK DC No': ['DC1', 'DC2', 'DC3'],
+        'FG Item Code': ['FG1', 'FG2', 'FG3'],
+        'Supplier Name': ['S1', 'S2', 'S3'],
+        'Transfer Qty': [' 5 ', '\t7', '2'],
+    })
+    received_df = pl.DataFrame({
+        'RouteCard No': ['RC1', 'RC2', 'RC3'],
+        'Subcon DC No': ['DC1', 'DC2', 'DC3'],
+        'FG Item Code': ['FG1', 'FG2', 'FG3'],
+        'Supplier Name': ['S1', 'S2', 'S3'],
+        'Rcvd. Qty': ['5', '7', ' 2\n'],
+    })
+
+    assert reconcile(issue_df, received_df).is_empty()
+
+def test_validate_store_treats_non_finite_quantities_as_zero():
+    issue_df = pd.DataFrame({
+        'FG Item Code': ['FG1', 'FG2'],
+        'RouteCard No': ['RC1', 'RC2'],
+        'GK DC No': ['DC1', 'DC2'],
+        'Transfer Qty': ['inf', '4'],
+        'Special Price': [1.0, 1.0],
+    })
+    received_df = pd.DataFrame({
+        'FG Item Code': ['FG1', 'FG2'],
+        'RouteCard No': ['RC1', 'RC2'],
+        'Subcon DC No': ['DC1', 'DC2'],
+        'Rcvd. Qty': ['nan', '-inf'],
+        'Special Price': [1.0, 1.0],
+    })
+
+    result = validate_store(issue_df, received_df)
+
+    assert result['summary']['total_records'] == 2
+    assert result['summary']['matched_records'] == 1
+    assert result['summary']['under_receipt_cases'] == 1
+    assert all(
+        math.isfinite(row['Qty Difference']) for row in result['mismatch_table']
+    )
+
+
+def test_validate_store_rejects_mismatched_key_types():
+    issue_df = pd.DataFrame({
+        'FG Item Code': [101],
+        'RouteCard No': ['RC1'],
+        'GK DC No': ['DC1'],
+        'Transfer Qty': [1],
+        'Special Price': [1.0],
+    })
+    received_df = pd.DataFrame({
+        'FG Item Code': ['101'],
+        'RouteCard No': ['RC1'],
+        'Subcon DC No': ['DC1'],
+        'Rcvd. Qty': [1],
+        'Special Price': [1.0],
+    })
+
+    with pytest.raises(ValueError, match='FG Item Code'):
+        validate_store(issue_df, received_df)
+
+
+def test_validate_store_accepts_int_keys_against_object_ints():
+    issue_df = pd.DataFrame({
+        'FG Item Code': [101, 102],
+        'RouteCard No': ['RC1', 'RC1'],
+        'GK DC No': ['DC1', 'DC1'],
+        'Transfer Qty': [1, 1],
+        'Special Price': [1.0, 1.0],
+    })
+    received_df = pd.DataFrame({
+        'FG Item Code': pd.Series([101, 'ABC'], dtype=object),
+        'RouteCard No': ['RC1', 'RC1'],
+        'Subcon DC No': ['DC1', 'DC1'],
+        'Rcvd. Qty': [1, 1],
+        'Special Price': [1.0, 1.0],
+    })
+
+    result = validate_store(issue_df, received_df)
+
+    assert result['summary']['total_records'] == 3
+    assert result['summary']['matched_records'] == 1
+
+
+def _store_frames():
+    issue_df = pd.DataFrame({
+        'FG Item Code': ['FG1', 'FG1', 'FG2', 'FG3', 'FG4'],
+        'RouteCard No': ['RC1', 'RC1', 'RC2', 'RC3', 'RC1'],
+        'GK DC No': ['DC1', 'DC1', 'DC2', 'DC3', 'DC2'],
+        'Transfer Qty': [2, 3, 4, 1, 6],
+        'Special Price': [1.0, 1.0, 2.0, 3.0, 1.5],
+    })
+    received_df = pd.DataFrame({
+        'FG Item Code': ['FG1', 'FG2', 'FG2', 'FG5', 'FG4'],
+        'RouteCard No': ['RC1', 'RC2', 'RC2', 'RC4', 'RC1'],
+        'Subcon DC No': ['DC1', 'DC2', 'DC2', 'DC4', 'DC2'],
+        'Rcvd. Qty': [5, 1, 2, 7, 6],
+        'Special Price': [1.0, 2.0, 2.0, 1.0, 1.0],
+    })
+    return issue_df, received_df
+
+
+def _full_table(result):
+    table = pd.DataFrame(**result['full_table'])
+    return table.sort_values(KEY_COLS).reset_index(drop=True)
+
+
+def test_pack_keys_round_trip():
+    categories = {
+        col: pd.Index([f'{col}-{i}' for i in range(5)]) for col in KEY_COLS
+    }
+    df = pd.DataFrame({
+        col: pd.Categorical.from_codes([4, 0, 2], categories[col])
+        for col in KEY_COLS
+    })
+
+    keys = _unpack_keys(_pack_keys(df), categories)
+
+    pd.testing.assert_frame_equal(keys, df)
+
+
+def test_validate_store_packed_merge_matches_plain_merge(monkeypatch):
+    packed = validate_store(*_store_frames(), include_full=True)
+
+    # Too few bits for the five FG codes forces the three-column merge
+    monkeypatch.setattr(validation_engine, 'KEY_BITS', 2)
+    plain = validate_store(*_store_frames(), include_full=True)
+
+    assert packed['summary'] == plain['summary']
+    assert packed['summary']['total_records'] == 5
+    pd.testing.assert_frame_equal(_full_table(packed), _full_table(plain))
+
+
+def test_read_excel_keeps_only_wanted_columns_with_padded_headers():
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append([
+        ' RouteCard No', 'GK DC No ', 'Remarks', 'FG Item Code',
+        'Supplier Name ', ' Transfer Qty ',
+    ])
+    sheet.append(['RC1', 'DC1', 'late', 'FG1', 'S1', 5])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    data = buffer.getvalue()
+
+    df = read_excel(data, ISSUE_COLS)
+
+    assert sorted(col.strip() for col in df.columns) == sorted(ISSUE_COLS)
+    assert df.row(0) == ('RC1', 'DC1', 'FG1', 'S1', 5)
+    # The column selection is part of the cache key
+    assert read_excel(data, ISSUE_COLS) is df
+    assert 'Remarks' in read_excel(data).columns
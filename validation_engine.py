@@ -1,12 +1,123 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
+import polars as pl
+from numba import njit
+
+
+KEY_COLS = ['FG Item Code', 'RouteCard No', 'GK DC No']
+
+# Keys shared by the issue and received sheets in reconcile()
+RECONCILE_KEY_COLS = ['RouteCard No', 'DC No', 'FG Item Code', 'Supplier Name']
+
+# Sheet columns reconcile() reads; everything else is skipped at load time
+ISSUE_COLS = ('RouteCard No', 'GK DC No', 'FG Item Code', 'Supplier Name', 'Transfer Qty')
+RECEIVED_COLS = ('RouteCard No', 'Subcon DC No', 'FG Item Code', 'Supplier Name', 'Rcvd. Qty')
+
+# Parsed workbooks kept in memory, most recently used last
+EXCEL_CACHE_SIZE = 16
+_excel_cache = OrderedDict()
+_excel_cache_lock = threading.Lock()
+
+# Bits per key code when the three keys are packed into one uint64
+KEY_BITS = 21
+
+# Quantities are summed as int64 thousandths so differences are exact
+QTY_DECIMALS = 3
+QTY_SCALE = 10 ** QTY_DECIMALS
+
+# Status labels indexed by the int8 codes produced by _classify
+RECEIPT_LABELS = np.array(["Matched", "Over Receipt", "Under Receipt"], dtype=object)
+MATCH_LABELS = np.array(["Matched", "Mismatch"], dtype=object)
+
+
+@njit(cache=True)
+def _classify(qty_issued, qty_received, price_issued, price_received):
+    """Compute both differences and all three status codes in one pass."""
+    n = len(qty_issued)
+    qty_difference = np.empty(n, dtype=np.float64)
+    price_difference = np.empty(n, dtype=np.float64)
+    receipt_status = np.empty(n, dtype=np.int8)
+    price_status = np.empty(n, dtype=np.int8)
+    overall_status = np.empty(n, dtype=np.int8)
+
+    for i in range(n):
+        qty = qty_issued[i] - qty_received[i]
+        price = price_issued[i] - price_received[i]
+        qty_difference[i] = qty
+        price_difference[i] = price
+
+        if qty == 0:
+            receipt_status[i] = 0
+        elif qty < 0:
+            receipt_status[i] = 1
+        else:
+            receipt_status[i] = 2
+
+        price_status[i] = 0 if price == 0 else 1
+        overall_status[i] = 0 if qty == 0 and price == 0 else 1
+
+    return (
+        qty_difference, price_difference,
+        receipt_status, price_status, overall_status
+    )
+
+
+def _pack_keys(df: pd.DataFrame) -> np.ndarray:
+    """Pack the categorical key codes of each row into a single uint64."""
+    packed = np.zeros(len(df), dtype=np.uint64)
+    for col in KEY_COLS:
+        codes = df[col].cat.codes.to_numpy().astype(np.uint64)
+        packed = (packed << np.uint64(KEY_BITS)) | codes
+    return packed
+
+
+def _unpack_keys(packed: np.ndarray, categories: dict) -> pd.DataFrame:
+    """Rebuild the categorical key columns from packed uint64 keys."""
+    mask = np.uint64((1 << KEY_BITS) - 1)
+    keys = {}
+    for col in reversed(KEY_COLS):
+        codes = (packed & mask).astype(np.int64)
+        keys[col] = pd.Categorical.from_codes(codes, categories[col])
+        packed = packed >> np.uint64(KEY_BITS)
+    return pd.DataFrame({col: keys[col] for col in KEY_COLS})
+
+
+def _mergeable_keys(left: pd.Series, right: pd.Series) -> bool:
+    """
+    pandas' merge rule for a numeric key against an object one: the object
+    values may be ints (or a mix of ints and text) but not only text.
+    """
+    if not len(left) or not len(right):
+        return True
+    if pd.api.types.is_bool_dtype(left) or pd.api.types.is_bool_dtype(right):
+        return True
+    if pd.api.types.is_numeric_dtype(left) == pd.api.types.is_numeric_dtype(right):
+        return True
+
+    integer_kinds = ('integer', 'mixed-integer', 'boolean', 'empty')
+    string_kinds = ('string', 'unicode', 'mixed', 'bytes', 'empty')
+    left_kind = pd.api.types.infer_dtype(left, skipna=False)
+    right_kind = pd.api.types.infer_dtype(right, skipna=False)
+    if left_kind in integer_kinds and right_kind in integer_kinds:
+        return True
+    return (left_kind in string_kinds) == (right_kind in string_kinds)
 
 
-def validate_store(issue_df: pd.DataFrame, received_df: pd.DataFrame) -> dict:
+def validate_store(
+    issue_df: pd.DataFrame,
+    received_df: pd.DataFrame,
+    include_full: bool = False
+) -> dict:
     """
     Production-grade store validation engine.
     Returns structured output including:
     - summary metrics
-    - full comparison table
+    - full comparison table (only with include_full, as columns/data lists)
     - mismatch-only table
     """
 
@@ -16,13 +127,13 @@ def validate_store(issue_df: pd.DataFrame, received_df: pd.DataFrame) -> dict:
     issue_df = issue_df.copy()
     received_df = received_df.copy()
 
-    issue_df['Transfer Qty'] = pd.to_numeric(
+    issue_df['Transfer Qty'] = (pd.to_numeric(
         issue_df['Transfer Qty'], errors='coerce'
-    ).fillna(0)
+    ).replace([np.inf, -np.inf], np.nan).fillna(0) * QTY_SCALE).round().astype(np.int64)
 
-    received_df['Rcvd. Qty'] = pd.to_numeric(
+    received_df['Rcvd. Qty'] = (pd.to_numeric(
         received_df['Rcvd. Qty'], errors='coerce'
-    ).fillna(0)
+    ).replace([np.inf, -np.inf], np.nan).fillna(0) * QTY_SCALE).round().astype(np.int64)
 
     issue_df['Special Price'] = pd.to_numeric(
         issue_df.get('Special Price', 0), errors='coerce'
@@ -32,88 +143,122 @@ def validate_store(issue_df: pd.DataFrame, received_df: pd.DataFrame) -> dict:
         received_df.get('Special Price', 0), errors='coerce'
     ).fillna(0)
 
+    received_df.rename(
+        columns={'Subcon DC No': 'GK DC No'},
+        inplace=True
+    )
+
+    # -------------------------------
+    # 2. Encode Keys
+    # -------------------------------
+    # Share one category dictionary per key so groupby and merge work on
+    # integer codes instead of hashing and comparing the raw values.
+    categories = {}
+    for col in KEY_COLS:
+        # A shared category index would quietly hold 1 and "1" side by side;
+        # reject mixed key types up front the way a plain merge does.
+        if not _mergeable_keys(issue_df[col], received_df[col]):
+            raise ValueError(
+                f"You are trying to merge on {issue_df[col].dtype} and {received_df[col].dtype} "
+                f"columns for key '{col}'. If you wish to proceed you should use pd.concat"
+            )
+        issue_keys = pd.Categorical(issue_df[col])
+        received_keys = pd.Categorical(received_df[col])
+        categories[col] = issue_keys.categories.union(received_keys.categories)
+        issue_df[col] = issue_keys.set_categories(categories[col])
+        received_df[col] = received_keys.set_categories(categories[col])
+
     # -------------------------------
-    # 2. Group Issue
+    # 3. Group Issue
     # -------------------------------
     issue_grouped = issue_df.groupby(
-        ['FG Item Code', 'RouteCard No', 'GK DC No'],
-        as_index=False
+        KEY_COLS,
+        as_index=False,
+        sort=False,
+        observed=True
     ).agg({
         'Transfer Qty': 'sum',
         'Special Price': 'mean'
     })
 
     # -------------------------------
-    # 3. Group Received
+    # 4. Group Received
     # -------------------------------
     received_grouped = received_df.groupby(
-        ['FG Item Code', 'RouteCard No', 'Subcon DC No'],
-        as_index=False
+        KEY_COLS,
+        as_index=False,
+        sort=False,
+        observed=True
     ).agg({
         'Rcvd. Qty': 'sum',
         'Special Price': 'mean'
     })
 
-    received_grouped.rename(
-        columns={'Subcon DC No': 'GK DC No'},
-        inplace=True
-    )
-
     # -------------------------------
-    # 4. Merge
+    # 5. Merge
     # -------------------------------
-    result = issue_grouped.merge(
-        received_grouped,
-        on=['FG Item Code', 'RouteCard No', 'GK DC No'],
-        how='outer',
-        suffixes=('_Issued', '_Received')
-    ).fillna(0)
+    # Join on one packed integer per row instead of three key columns,
+    # unless a key has too many distinct values to fit in KEY_BITS.
+    if all(len(categories[col]) <= 1 << KEY_BITS for col in KEY_COLS):
+        merged = issue_grouped.drop(columns=KEY_COLS).assign(
+            _k=_pack_keys(issue_grouped)
+        ).merge(
+            received_grouped.drop(columns=KEY_COLS).assign(
+                _k=_pack_keys(received_grouped)
+            ),
+            on='_k',
+            how='outer',
+            suffixes=('_Issued', '_Received')
+        )
+        keys = _unpack_keys(merged.pop('_k').to_numpy(), categories)
+        result = pd.concat([keys, merged], axis=1)
+    else:
+        result = issue_grouped.merge(
+            received_grouped,
+            on=KEY_COLS,
+            how='outer',
+            suffixes=('_Issued', '_Received')
+        )
 
-    # -------------------------------
-    # 5. Quantity Difference
-    # -------------------------------
-    result['Qty Difference'] = (
-        result['Transfer Qty'] - result['Rcvd. Qty']
-    )
-
-    result['Receipt Status'] = result['Qty Difference'].apply(
-        lambda x: "Matched" if x == 0
-        else "Over Receipt" if x < 0
-        else "Under Receipt"
-    )
+    # Groups missing on one side count as zero; fill and cast in one pass
+    # per column rather than a frame-wide fillna
+    values = {}
+    for col in ['Transfer Qty', 'Special Price_Issued', 'Rcvd. Qty', 'Special Price_Received']:
+        values[col] = result[col].to_numpy(dtype=np.float64, na_value=0.0)
+        result[col] = values[col]
 
     # -------------------------------
-    # 6. Price Difference
+    # 6. Differences and Statuses
     # -------------------------------
-    result['Price Difference'] = (
-        result['Special Price_Issued'] -
-        result['Special Price_Received']
+    (
+        qty_difference, price_difference,
+        receipt_status, price_status, overall_status
+    ) = _classify(
+        values['Transfer Qty'],
+        values['Rcvd. Qty'],
+        values['Special Price_Issued'],
+        values['Special Price_Received']
     )
 
-    result['Price Status'] = result['Price Difference'].apply(
-        lambda x: "Matched" if x == 0 else "Mismatch"
-    )
+    # Scaled quantities are whole numbers, so the kernel's comparisons were
+    # exact; convert back to units for the output
+    result['Transfer Qty'] = values['Transfer Qty'] / QTY_SCALE
+    result['Rcvd. Qty'] = values['Rcvd. Qty'] / QTY_SCALE
+    result['Qty Difference'] = qty_difference / QTY_SCALE
+    result['Receipt Status'] = np.take(RECEIPT_LABELS, receipt_status)
+    result['Price Difference'] = price_difference
+    result['Price Status'] = np.take(MATCH_LABELS, price_status)
+    result['Overall Status'] = np.take(MATCH_LABELS, overall_status)
 
     # -------------------------------
-    # 7. Overall Status
-    # -------------------------------
-    result['Overall Status'] = result.apply(
-        lambda row: "Matched"
-        if row['Receipt Status'] == "Matched"
-        and row['Price Status'] == "Matched"
-        else "Mismatch",
-        axis=1
-    )
-
-    # -------------------------------
-    # 8. Summary Metrics
+    # 7. Summary Metrics
     # -------------------------------
     total_records = len(result)
-    total_mismatch = len(result[result['Overall Status'] == "Mismatch"])
-    total_matched = len(result[result['Overall Status'] == "Matched"])
-    over_receipt = len(result[result['Receipt Status'] == "Over Receipt"])
-    under_receipt = len(result[result['Receipt Status'] == "Under Receipt"])
-    price_mismatch = len(result[result['Price Status'] == "Mismatch"])
+    total_mismatch = np.count_nonzero(overall_status)
+    total_matched = total_records - total_mismatch
+    over_receipt = np.count_nonzero(receipt_status == 1)
+    under_receipt = np.count_nonzero(receipt_status == 2)
+    price_mismatch = np.count_nonzero(price_status)
 
     summary = {
         "total_records": int(total_records),
@@ -125,13 +270,168 @@ def validate_store(issue_df: pd.DataFrame, received_df: pd.DataFrame) -> dict:
     }
 
     # -------------------------------
-    # 9. Mismatch Table
+    # 8. Mismatch Table
     # -------------------------------
-    mismatch_table = result[result['Overall Status'] == "Mismatch"]
+    # Gather by position from the status codes instead of re-scanning
+    # the label column into a boolean mask
+    mismatch_table = result.take(np.flatnonzero(overall_status))
 
     # Convert to JSON-safe format
-    return {
+    output = {
         "summary": summary,
-        "full_table": result.to_dict(orient="records"),
         "mismatch_table": mismatch_table.to_dict(orient="records")
     }
+
+    # The full table is usually far larger than the mismatches, so it is only
+    # built on request and in the columnar "split" layout
+    if include_full:
+        output["full_table"] = result.to_dict(orient="split", index=False)
+
+    return output
+
+
+def cached_excel(key):
+    """Return a previously parsed workbook stored under key, or None."""
+    with _excel_cache_lock:
+        df = _excel_cache.get(key)
+        if df is not None:
+            _excel_cache.move_to_end(key)
+        return df
+
+
+def cache_excel(key, df: pl.DataFrame) -> None:
+    """Store a parsed workbook under key, evicting the least recently used."""
+    with _excel_cache_lock:
+        _excel_cache[key] = df
+        if len(_excel_cache) > EXCEL_CACHE_SIZE:
+            _excel_cache.popitem(last=False)
+
+
+def read_excel(data: bytes, columns: tuple = None, digest: bytes = None) -> pl.DataFrame:
+    """
+    Parse an Excel workbook with calamine.
+    Only the given columns are decoded (header names are matched after
+    stripping spaces). Identical content is only decoded once; pass digest
+    when the blake2b (16 byte) hash of data is already known.
+    """
+    if digest is None:
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+
+    df = cached_excel((digest, columns))
+    if df is None:
+        read_options = None
+        if columns is not None:
+            wanted = set(columns)
+            read_options = {'use_columns': lambda column: column.name.strip() in wanted}
+
+        # Infer types from every row: a sample would null out any later cell
+        # that does not fit, e.g. a text route card below numeric ones
+        df = pl.read_excel(
+            io.BytesIO(data),
+            engine='calamine',
+            read_options=read_options,
+            infer_schema_length=None
+        )
+        cache_excel((digest, columns), df)
+    return df
+
+
+def _qty_thousandths(lf: pl.LazyFrame, column: str) -> pl.Expr:
+    """
+    Quantity column as int64 thousandths. Text cells are stripped first so
+    padded numbers still parse; text, NaN and inf fail the non-strict casts
+    and count as zero.
+    """
+    qty = pl.col(column)
+    if lf.collect_schema()[column] == pl.Utf8:
+        qty = qty.str.strip_chars()
+    return (
+        (qty.cast(pl.Float64, strict=False) * QTY_SCALE)
+        .round()
+        .cast(pl.Int64, strict=False)
+        .fill_null(0)
+    )
+
+
+def reconcile(
+    issue_df: pl.DataFrame,
+    received_df: pl.DataFrame,
+    route_card: str = None,
+    supplier: str = None
+) -> pl.DataFrame:
+    """
+    Issue vs received quantity reconciliation shared by the /validate APIs.
+    Returns one row per mismatched (RouteCard No, DC No, FG Item Code,
+    Supplier Name) group with Issue_Qty, Received_Qty and Difference.
+    """
+
+    # -------------------------------
+    # 1. Clean Column Names
+    # -------------------------------
+    issue_lf = issue_df.lazy().rename(str.strip).rename({'GK DC No': 'DC No'})
+    received_lf = received_df.lazy().rename(str.strip).rename({'Subcon DC No': 'DC No'})
+
+    # -------------------------------
+    # 2. Normalize Key Columns
+    # -------------------------------
+    # One projection per frame: cast+strip every key and coerce the quantity
+    # to int64 thousandths so sums and the != 0 test are exact
+    issue_lf = issue_lf.with_columns(
+        pl.col(RECONCILE_KEY_COLS).cast(pl.Utf8).str.strip_chars(),
+        _qty_thousandths(issue_lf, 'Transfer Qty')
+    )
+    received_lf = received_lf.with_columns(
+        pl.col(RECONCILE_KEY_COLS).cast(pl.Utf8).str.strip_chars(),
+        _qty_thousandths(received_lf, 'Rcvd. Qty')
+    )
+
+    # Optional filters, applied before aggregation so only matching rows are grouped
+    if route_card:
+        issue_lf = issue_lf.filter(pl.col('RouteCard No') == str(route_card))
+        received_lf = received_lf.filter(pl.col('RouteCard No') == str(route_card))
+
+    if supplier:
+        issue_lf = issue_lf.filter(pl.col('Supplier Name') == supplier)
+        received_lf = received_lf.filter(pl.col('Supplier Name') == supplier)
+
+    # -------------------------------
+    # 3. Aggregate Issue and Received Together
+    # -------------------------------
+    # Stack both sheets with the quantity in its own column (0 on the other
+    # side) and aggregate once, instead of two group_bys plus a full join.
+    # Null keys group together, as they matched each other in the join.
+    stacked = pl.concat([
+        issue_lf.select(
+            pl.col(RECONCILE_KEY_COLS),
+            pl.col('Transfer Qty').alias('Issue_Qty'),
+            pl.lit(0, dtype=pl.Int64).alias('Received_Qty')
+        ),
+        received_lf.select(
+            pl.col(RECONCILE_KEY_COLS),
+            pl.lit(0, dtype=pl.Int64).alias('Issue_Qty'),
+            pl.col('Rcvd. Qty').alias('Received_Qty')
+        )
+    ])
+
+    merged = stacked.group_by(RECONCILE_KEY_COLS).agg(
+        pl.col('Issue_Qty').sum(),
+        pl.col('Received_Qty').sum()
+    )
+
+    # -------------------------------
+    # 4. Difference (mismatches only)
+    # -------------------------------
+    merged = merged.with_columns(
+        (pl.col('Issue_Qty') - pl.col('Received_Qty')).alias('Difference')
+    )
+
+    return (
+        merged
+        .filter(pl.col('Difference') != 0)
+        .with_columns(
+            pl.col(pl.Utf8).fill_null(''),
+            # Polars divides by a scalar via its reciprocal, so round off the last ulp
+            (pl.col('Issue_Qty', 'Received_Qty', 'Difference') / QTY_SCALE).round(QTY_DECIMALS)
+        )
+        .collect()
+    )